@@ -1,6 +1,13 @@
+import queue
+import threading
 import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from datetime import datetime
 from typing import List
+import numpy as np
 import pandas as pd
+from vesting import Grant
 
 
 class TaxRate:
@@ -12,7 +19,18 @@ class TaxRate:
 st.title("Option Exercise Modeling")
 
 
-# Main Model class
+@dataclass(frozen=True)
+class ModelParams:
+    taxable_income: float
+    iso_total_units: int
+    nso_total_units: int
+    strike_price: float
+    fmv: float
+    sell_price: float
+    sell_month: int
+
+
+# Main Model class, stateless so that one instance can serve every session
 class Model:
     # 12000 exemption
     INCOME_TAX_BRACKETS = [
@@ -68,6 +86,9 @@ class Model:
             + self.get_tax(self.STATE_TAX_BRACKETS, amount)
         )
 
+    def get_federal_income_tax(self, amount):
+        return self.get_tax(self.INCOME_TAX_BRACKETS, amount)
+
     def get_capital_gain_tax(self, amount):
         return (
             self.get_tax(self.CAPITAL_GAIN_BRACKETS, amount)
@@ -91,25 +112,25 @@ class Model:
             tax += diff * tax_brackets[idx].rate
         return tax
 
-    def compute(self, iso_exercise_units, nso_exercise_units):
-        spread = self.fmv - self.strike_price  # 19 - 15
+    def compute(self, params: ModelParams, iso_exercise_units, nso_exercise_units):
+        spread = params.fmv - params.strike_price  # 19 - 15
 
         income_tax_total = self.get_income_tax(
-            self.taxable_income + nso_exercise_units * spread
+            params.taxable_income + nso_exercise_units * spread
         )
-        income_tax_without_options = self.get_income_tax(self.taxable_income)
+        income_tax_without_options = self.get_income_tax(params.taxable_income)
         income_tax_due = income_tax_total - income_tax_without_options
 
         amt_tax_total = self.get_tax(
             self.AMT_TAX_BRACKETS,
-            self.taxable_income + (nso_exercise_units + iso_exercise_units) * spread,
+            params.taxable_income + (nso_exercise_units + iso_exercise_units) * spread,
         )
         # when comparing with amt tax, dont include FICA tax
         amt_tax_due = max(
             0,
             amt_tax_total
             - self.get_federal_income_tax(
-                self.taxable_income + nso_exercise_units * spread
+                params.taxable_income + nso_exercise_units * spread
             ),
         )
 
@@ -117,26 +138,26 @@ class Model:
         tax_due_now = amt_tax_due + income_tax_due
 
         tax_after = self.get_capital_gain_tax(
-            iso_exercise_units * (self.sell_price - self.strike_price)
-            + nso_exercise_units * (self.sell_price - self.fmv)
+            iso_exercise_units * (params.sell_price - params.strike_price)
+            + nso_exercise_units * (params.sell_price - params.fmv)
         )
         cost_now = (
             iso_exercise_units + nso_exercise_units
-        ) * self.strike_price + tax_due_now
+        ) * params.strike_price + tax_due_now
 
         long_term_profit = (
-            (iso_exercise_units + nso_exercise_units) * self.sell_price
+            (iso_exercise_units + nso_exercise_units) * params.sell_price
             - cost_now
             - tax_after
         )
 
         # tax if don't exercise now
-        new_spread = self.sell_price - self.strike_price  # 60 - 15
+        new_spread = params.sell_price - params.strike_price  # 60 - 15
         income_tax_total = self.get_income_tax(
-            self.taxable_income + nso_exercise_units * new_spread
+            params.taxable_income + nso_exercise_units * new_spread
         )
         income_tax_due_for_exercise_after_public = (
-            income_tax_total - self.get_income_tax(self.taxable_income)
+            income_tax_total - self.get_income_tax(params.taxable_income)
         )
 
         capital_gain_for_exercise_after_public = self.get_capital_gain_tax(
@@ -145,7 +166,7 @@ class Model:
 
         amt_tax_for_exercise_after_public = self.get_tax(
             self.AMT_TAX_BRACKETS,
-            self.taxable_income
+            params.taxable_income
             + (iso_exercise_units + nso_exercise_units) * new_spread,
         )
 
@@ -163,46 +184,49 @@ class Model:
         tax_savings = tax_for_exercise_after_public - tax_after - tax_due_now
 
         original_tax_rate = tax_for_exercise_after_public / (
-            (self.sell_price - self.strike_price)
+            (params.sell_price - params.strike_price)
             * (iso_exercise_units + nso_exercise_units)
         )
 
         current_tax_rate = (tax_after + tax_due_now) / (
-            (self.sell_price - self.strike_price)
+            (params.sell_price - params.strike_price)
             * (iso_exercise_units + nso_exercise_units)
         )
 
         # sellable stock
         nso_units_first_vest = (
-            self.nso_total_units + self.iso_total_units
-        ) / 4 - self.iso_total_units
+            Grant(
+                params.nso_total_units + params.iso_total_units, datetime.today()
+            ).first_vest_units()
+            - params.iso_total_units
+        )
 
-        sellable_iso = self.iso_total_units - iso_exercise_units
+        sellable_iso = params.iso_total_units - iso_exercise_units
         sellable_nso = max(nso_units_first_vest - nso_exercise_units, 0)
 
         sellable_stock_value = (sellable_iso + sellable_nso) * (
-            self.sell_price - self.strike_price
+            params.sell_price - params.strike_price
         )
 
         sellable_stock_value_after_tax = (
             sellable_stock_value
             - self.get_income_tax(
-                sellable_nso * (self.sell_price - self.strike_price)
-                + self.taxable_income
+                sellable_nso * (params.sell_price - params.strike_price)
+                + params.taxable_income
             )
             - self.get_capital_gain_tax(
-                sellable_iso * (self.sell_price - self.strike_price)
+                sellable_iso * (params.sell_price - params.strike_price)
             )
-            + self.get_income_tax(self.taxable_income)
+            + self.get_income_tax(params.taxable_income)
         )
 
         sellable_nso_stock_value_after_tax = (
-            sellable_nso * (self.sell_price - self.strike_price)
+            sellable_nso * (params.sell_price - params.strike_price)
             - self.get_income_tax(
-                sellable_nso * (self.sell_price - self.strike_price)
-                + self.taxable_income
+                sellable_nso * (params.sell_price - params.strike_price)
+                + params.taxable_income
             )
-            + self.get_income_tax(self.taxable_income)
+            + self.get_income_tax(params.taxable_income)
         )
 
         return {
@@ -216,20 +240,180 @@ class Model:
         }
 
 
-if __name__ == "__main__":
+@st.cache_resource
+def get_model() -> Model:
+    return Model()
+
+
+# params are hashable, so they double as the cache key across sessions
+@st.cache_data(max_entries=4096)
+def compute(params: ModelParams, iso_exercise_units, nso_exercise_units):
+    return get_model().compute(params, iso_exercise_units, nso_exercise_units)
+
+
+# fixed schema of Model.compute results for batches
+COMPUTE_DTYPE = np.dtype(
+    [
+        ("cost_now", "i8"),
+        ("total_tax_savings", "i8"),
+        ("amt_tax_saving_for_exercise_after_public", "f8"),
+        ("long_term_profit_after_tax", "i8"),
+        ("sellable_stock_value_after_tax", "i8"),
+        ("orginal_tax_rate", "i8"),
+        ("current_tax_rate", "i8"),
+    ]
+)
+
+
+def compute_many(requests, max_workers=None, as_array=False):
+    # requests are (params, iso_exercise_units, nso_exercise_units) tuples
     model = Model()
-    model.taxable_income = st.sidebar.number_input(
+    with ThreadPoolExecutor(max_workers) as executor:
+        results = executor.map(lambda request: model.compute(*request), requests)
+        if not as_array:
+            return list(results)
+
+        return np.fromiter(
+            (tuple(result.values()) for result in results),
+            COMPUTE_DTYPE,
+            len(requests),
+        )
+
+
+# parameter moved one step down and up for the tornado chart
+SENSITIVITY_STEPS = [
+    ("sell_price", 1),
+    ("taxable_income", 10000),
+    ("iso_exercise_units", 1000),
+    ("nso_exercise_units", 1000),
+]
+
+
+def get_sensitivities(params: ModelParams, iso_exercise_units, nso_exercise_units):
+    # long_term_profit_after_tax one step down and up for each parameter, all
+    # computed in one compute_many batch; exercised units stay at 1 or more
+    # since compute divides by them
+    base = {
+        "iso_exercise_units": iso_exercise_units,
+        "nso_exercise_units": nso_exercise_units,
+    }
+    requests = []
+    for name, step in SENSITIVITY_STEPS:
+        for sign in (-1, 1):
+            if name in base:
+                units = {**base, name: max(base[name] + sign * step, 1)}
+                requests.append((params, *units.values()))
+            else:
+                shifted = replace(params, **{name: getattr(params, name) + sign * step})
+                requests.append((shifted, *base.values()))
+    results = compute_many([(params, *base.values())] + requests)
+
+    profit = results[0]["long_term_profit_after_tax"]
+    return pd.DataFrame(
+        [
+            {
+                "parameter": f"{name} ±{step}",
+                "down": results[2 * idx + 1]["long_term_profit_after_tax"] - profit,
+                "up": results[2 * idx + 2]["long_term_profit_after_tax"] - profit,
+            }
+            for idx, (name, step) in enumerate(SENSITIVITY_STEPS)
+        ]
+    )
+
+
+def sweep(
+    model: Model, params: ModelParams, grid, results: queue.Queue, cancel, chunk=50
+):
+    # computes the grid of (iso_exercise_units, nso_exercise_units) in chunks,
+    # putting each chunk on results and None once done, or the exception that
+    # stopped it so the script waiting on results doesn't block forever
+    try:
+        for start in range(0, len(grid), chunk):
+            if cancel.is_set():
+                return
+
+            results.put(
+                [
+                    {
+                        "iso_exercise_units": iso_exercise_units,
+                        "nso_exercise_units": nso_exercise_units,
+                        **model.compute(params, iso_exercise_units, nso_exercise_units),
+                    }
+                    for iso_exercise_units, nso_exercise_units in grid[
+                        start : start + chunk
+                    ]
+                ]
+            )
+    except Exception as e:
+        results.put(e)
+        return
+    results.put(None)
+
+
+def cancel_sweep():
+    # a rerun (e.g. a moved slider) interrupts this script run, so the worker of
+    # the previous run is cancelled before starting a new one or none at all
+    previous = st.session_state.pop("sweep_cancel", None)
+    if previous is not None:
+        previous.set()
+
+
+def stream_sweep(params: ModelParams, steps=20):
+    cancel_sweep()
+    cancel = threading.Event()
+    st.session_state["sweep_cancel"] = cancel
+
+    # compute divides by the exercised units, so the grid starts at 1 unit
+    grid = [
+        (int(iso_exercise_units), int(nso_exercise_units))
+        for iso_exercise_units in np.unique(
+            np.linspace(1, params.iso_total_units, steps)
+        )
+        for nso_exercise_units in np.unique(
+            np.linspace(1, params.nso_total_units, steps)
+        )
+    ]
+    results = queue.Queue()
+    threading.Thread(
+        target=sweep, args=(get_model(), params, grid, results, cancel), daemon=True
+    ).start()
+
+    progress = st.progress(0.0)
+    chart = st.empty()
+    best_table = st.empty()
+    rows = []
+    while True:
+        chunk = results.get()
+        if chunk is None:
+            break
+        if isinstance(chunk, Exception):
+            raise chunk
+
+        rows += chunk
+        df = pd.DataFrame(rows)
+        progress.progress(len(rows) / len(grid))
+        chart.scatter_chart(
+            df,
+            x="nso_exercise_units",
+            y="long_term_profit_after_tax",
+            color="iso_exercise_units",
+        )
+        best_table.table(df.nlargest(5, "long_term_profit_after_tax"))
+
+
+if __name__ == "__main__":
+    taxable_income = st.sidebar.number_input(
         "Taxable income without option", 100000, 500000, 200000, 5000
     )
 
-    model.iso_total_units = st.sidebar.number_input(
+    iso_total_units = st.sidebar.number_input(
         "Total exercisable ISO units",
         5000,
         30000,
         5000,
         10,
     )
-    model.nso_total_units = st.sidebar.number_input(
+    nso_total_units = st.sidebar.number_input(
         "Total exercisable NSO units",
         5000,
         200000,
@@ -237,11 +421,11 @@ if __name__ == "__main__":
         10,
     )
 
-    model.strike_price = st.sidebar.number_input("Strike price", 0.0, 30.0, 10.0, 0.1)
-    model.fmv = st.sidebar.number_input("Fair market value", 0.0, 50.0, 10.0, 0.1)
-    model.sell_price = st.sidebar.number_input("Sell price", 0.0, 200.0, 100.0, 0.1)
+    strike_price = st.sidebar.number_input("Strike price", 0.0, 30.0, 10.0, 0.1)
+    fmv = st.sidebar.number_input("Fair market value", 0.0, 50.0, 10.0, 0.1)
+    sell_price = st.sidebar.number_input("Sell price", 0.0, 200.0, 100.0, 0.1)
 
-    model.sell_month = st.sidebar.slider(
+    sell_month = st.sidebar.slider(
         "Months after grant to sell",
         12,
         24,
@@ -252,7 +436,7 @@ if __name__ == "__main__":
     iso_exercise_units = st.sidebar.slider(
         "Number of ISO units to exercise",
         0,
-        model.iso_total_units,
+        iso_total_units,
         1,
         10,
     )
@@ -260,7 +444,7 @@ if __name__ == "__main__":
     nso_exercise_units = st.sidebar.slider(
         "Number of NSO units to exercise",
         0,
-        model.nso_total_units,
+        nso_total_units,
         1,
         10,
     )
@@ -274,10 +458,34 @@ if __name__ == "__main__":
         "### This assumes you sell all exercised options in the same year after holding period required by long term capital gain"
     )
 
-    output = model.compute(iso_exercise_units, nso_exercise_units)
+    params = ModelParams(
+        taxable_income,
+        iso_total_units,
+        nso_total_units,
+        strike_price,
+        fmv,
+        sell_price,
+        sell_month,
+    )
+    output = compute(params, iso_exercise_units, nso_exercise_units)
     df = pd.DataFrame(
         [[key, value] for key, value in output.items()],
         columns=["name", "dollar value"],
     )
 
     st.table(df)
+
+    if st.sidebar.checkbox("Show sensitivities"):
+        st.markdown("### Change in long term profit after tax per step")
+        st.bar_chart(
+            get_sensitivities(params, iso_exercise_units, nso_exercise_units),
+            x="parameter",
+            y=["down", "up"],
+            horizontal=True,
+        )
+
+    if st.sidebar.checkbox("Sweep exercised units"):
+        st.markdown("### Best exercised units by long term profit after tax")
+        stream_sweep(params)
+    else:
+        cancel_sweep()
@@ -0,0 +1,105 @@
+import timeit
+
+import numpy as np
+
+from tax import (
+    FILING_STATUSES,
+    FMV_AT_EXERCISE,
+    FYS,
+    GRANT_DATE,
+    RESIDENCY,
+    Event,
+    get_fy_projection,
+    get_fy_projection_fused,
+    get_projections_fused,
+)
+
+# schedules from projection.ipynb
+SCHEDULES = {
+    "iso in 2022": [
+        Event("Jun 01 2022", "sale", "nso", 5125, FMV_AT_EXERCISE),
+        Event("Sep 01 2022", "sale", "nso", 5375, FMV_AT_EXERCISE),
+        Event("Sep 01 2022", "exercise", "iso", 6377),
+        Event("Dec 01 2022", "sale", "nso", 10250, FMV_AT_EXERCISE),
+        Event(
+            "Dec 01 2023",
+            "sale",
+            "iso",
+            6377,
+            Event("Sep 01 2022", "exercise", "iso", 6377).price,
+        ),
+    ],
+    "iso in 2024": [
+        Event("Sep 01 2022", "sale", "nso", 5125, FMV_AT_EXERCISE),
+        Event("Dec 01 2022", "sale", "nso", 5125, FMV_AT_EXERCISE),
+        Event("Mar 01 2023", "exercise and sale", "nso", 4000),
+        Event("Jun 01 2023", "exercise and sale", "nso", 4500),
+        Event("Sep 01 2023", "sale", "nso", 5125, FMV_AT_EXERCISE),
+        Event("Dec 01 2023", "sale", "nso", 5125, FMV_AT_EXERCISE),
+        Event("Mar 01 2024", "exercise", "iso", 6377),
+        Event("Mar 01 2024", "exercise and sale", "nso", 5000),
+        Event("Jun 01 2024", "exercise and sale", "nso", 5500),
+        Event("Sep 01 2024", "exercise and sale", "nso", 6000),
+        Event("Dec 01 2024", "exercise and sale", "nso", 6500),
+        Event(
+            "Mar 01 2025",
+            "sale",
+            "iso",
+            6377,
+            Event("Mar 01 2024", "exercise", "iso", 6377).price,
+        ),
+        Event("Mar 01 2025", "exercise and sale", "nso", 18623),
+    ],
+}
+
+
+def projections(get_projection, events):
+    return [
+        get_projection(married, fy, events)
+        for fy in FYS.values()
+        for married in (True, False)
+    ]
+
+
+def schedule_projections(events):
+    return get_projections_fused(list(FYS.values()), events, ["married", "single"])
+
+
+def per_call(run, calls, number=2000):
+    seconds = min(timeit.repeat(run, number=number, repeat=5))
+    return seconds / number / calls * 1e6
+
+
+def check_residency(events):
+    # the vectorized allocation sources every event like the per-event ratio
+    dates = [e.date for e in events]
+    ratios = RESIDENCY.ratios(GRANT_DATE, dates)
+    for idx, state in enumerate(RESIDENCY.states):
+        expected = [RESIDENCY.ratio(state, GRANT_DATE, date) for date in dates]
+        assert np.array_equal(ratios[idx], expected)
+
+
+if __name__ == "__main__":
+    for name, events in SCHEDULES.items():
+        check_residency(events)
+        # get_fy_projection (evaluate_fy) is the reference fy_values must match
+        expected = projections(get_fy_projection, events)
+        assert projections(get_fy_projection_fused, events) == expected
+        assert schedule_projections(events) == expected
+        assert get_projections_fused(list(FYS.values()), events) == [
+            get_fy_projection(status, fy, events)
+            for fy in FYS.values()
+            for status in FILING_STATUSES
+        ]
+
+        calls = 2 * len(FYS)
+        reference = per_call(lambda: projections(get_fy_projection, events), calls)
+        fused = per_call(lambda: projections(get_fy_projection_fused, events), calls)
+        schedule = per_call(lambda: schedule_projections(events), calls)
+
+        print(
+            f"{name}: get_fy_projection {reference:.1f}us,"
+            f" get_fy_projection_fused {fused:.1f}us ({reference / fused:.1f}x),"
+            f" get_projections_fused {schedule:.1f}us ({reference / schedule:.1f}x)"
+            " per call"
+        )
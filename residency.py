@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+import numpy as np
+
+
+class Residency:
+    """
+    Allocates income earned between two dates across the states lived in over
+    that period, pro rata to the workdays (Monday to Friday) spent in each.
+
+    timeline lists (state, first day of residency) in date order; each
+    residency lasts until the next one starts, the last one until end.
+    """
+
+    def __init__(self, timeline: List[Tuple[str, datetime]], end: datetime):
+        self.states = list(dict.fromkeys(state for state, _ in timeline))
+        self.origin_date = timeline[0][1]
+        self.origin = np.datetime64(self.origin_date, "D")
+        days = np.arange(
+            self.origin,
+            np.datetime64(end + timedelta(days=1), "D"),
+            dtype="datetime64[D]",
+        )
+
+        starts = np.array([start for _, start in timeline], dtype="datetime64[D]")
+        residency = np.searchsorted(starts, days, side="right") - 1
+        state_idx = np.array([self.states.index(state) for state, _ in timeline])
+
+        # workdays spent in each state before each day, so any period is O(1)
+        workdays = np.zeros((len(self.states), len(days) + 1))
+        workdays[state_idx[residency], np.arange(len(days)) + 1] = np.is_busday(days)
+        self.prefix = np.cumsum(workdays, axis=1)
+        self.total = self.prefix.sum(axis=0)
+        # plain lists for single lookups, which numpy indexing would slow down
+        self.prefix_rows = self.prefix.tolist()
+        self.total_row = self.total.tolist()
+
+    def index(self, dates):
+        offsets = (np.array(dates, dtype="datetime64[D]") - self.origin).astype(int)
+        return np.clip(offsets, 0, self.prefix.shape[1] - 1)
+
+    def ratios(self, start_dates, end_dates):
+        # share of the workdays from start_dates up to end_dates spent in each
+        # state, as an array of shape (len(states),) + shape of the dates
+        # one start date (e.g. the grant date) may go with many end dates
+        start, end = np.broadcast_arrays(self.index(start_dates), self.index(end_dates))
+        days = self.total[end] - self.total[start]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.nan_to_num((self.prefix[:, end] - self.prefix[:, start]) / days)
+
+    def ratio(self, state, start_date: datetime, end_date: datetime) -> float:
+        if state not in self.states:
+            return 0.0
+
+        last = len(self.total_row) - 1
+        start = min(max((start_date - self.origin_date).days, 0), last)
+        end = min(max((end_date - self.origin_date).days, 0), last)
+        days = self.total_row[end] - self.total_row[start]
+        if days == 0:
+            return 0.0
+
+        prefix = self.prefix_rows[self.states.index(state)]
+        return (prefix[end] - prefix[start]) / days
+
+    def allocate(self, incomes, start_dates, end_dates):
+        # income of every event sourced to each state
+        return dict(
+            zip(self.states, self.ratios(start_dates, end_dates) * np.asarray(incomes))
+        )
@@ -0,0 +1,205 @@
+from datetime import datetime, timedelta
+from typing import List
+
+from tax import (
+    CAPITAL_GAIN_TAX_BRACKETS,
+    END_DATE,
+    FY,
+    GRANT_DATE,
+    MOVE_DATE,
+    NIIT_TAX_BRACKETS,
+    Event,
+    FYSummary,
+    Model,
+    evaluate_fy,
+    linear_price,
+    to_date,
+)
+
+
+class Holding:
+    def __init__(self, option_type, quantity, exercise_price=None, exercise_date=None):
+        self.option_type = option_type
+        self.quantity = quantity
+        self.exercise_price = exercise_price
+        self.exercise_date = (
+            to_date(exercise_date) if isinstance(exercise_date, str) else exercise_date
+        )
+        if option_type == "iso" and self.exercise_date is None:
+            raise ValueError("iso holdings need an exercise_date")
+        if option_type != "iso" and exercise_price is None:
+            raise ValueError("nso holdings need an exercise_price")
+
+    def first_sale_date(self) -> datetime:
+        if self.option_type != "iso":
+            if self.exercise_date is None:
+                return MOVE_DATE
+            return max(MOVE_DATE, self.exercise_date)
+
+        # qualifying disposition: more than 1 year after exercise and more than
+        # 2 years after grant
+        return max(
+            add_years(self.exercise_date, 1), add_years(GRANT_DATE, 2)
+        ) + timedelta(days=1)
+
+
+def add_years(date: datetime, years) -> datetime:
+    try:
+        return date.replace(year=date.year + years)
+    except ValueError:  # Feb 29
+        return date.replace(year=date.year + years, day=28)
+
+
+class YearState:
+    # capital gain tax of a fiscal year as sales are added to it; only the
+    # capital gain and the sale proceeds of a year depend on sale events
+    def __init__(self, married, fy: FY, events: List[Event]):
+        summary = FYSummary(fy, events)
+        self.m = Model(married)
+        self.income = summary.joint_income(self.m.married)
+        self.base_capital_gain = summary.capital_gain
+        self.base_cash = evaluate_fy(married, summary)["cash"]
+        self.capital_gain = 0
+        self.proceeds = 0
+
+    def tax(self, capital_gain):
+        capital_gain += self.base_capital_gain
+        return self.m.get_capital_gain_tax(
+            capital_gain, self.income
+        ) + self.m.get_niit_tax(capital_gain)
+
+    def cash(self, capital_gain=0, proceeds=0):
+        capital_gain += self.capital_gain
+        proceeds += self.proceeds
+        return self.base_cash + proceeds - self.tax(capital_gain) + self.tax(0)
+
+
+def search_sale_dates(
+    married,
+    fys: List[FY],
+    holdings: List[Holding],
+    events: List[Event] = None,
+    price_model=linear_price,
+    start: datetime = MOVE_DATE,
+    end: datetime = END_DATE,
+):
+    """
+    Picks the sale date of every holding that maximizes after-tax cash over
+    fys, on top of the already scheduled events.
+
+    Sales only change a year's capital gain and proceeds, and the marginal
+    capital gain tax rate is below 100%, so within a year the highest-priced
+    eligible day dominates every other day for the same holding. That leaves
+    one candidate per holding and year, which are then searched with
+    branch-and-bound.
+    """
+    events = events or []
+    status = Model(married).status
+    # get_capital_gain_tax only applies the 2nd and 3rd brackets
+    rates = [rate.rate for rate in CAPITAL_GAIN_TAX_BRACKETS[status][1:]]
+    niit_rate = NIIT_TAX_BRACKETS[status][-1].rate
+    min_rate, max_rate = min(rates) + niit_rate, max(rates) + niit_rate
+    if max_rate >= 1:
+        raise ValueError("capital gain tax rates must be below 100%")
+
+    years = {fy.date.year: YearState(married, fy, events) for fy in fys}
+
+    days = [start + timedelta(days=n) for n in range((end - start).days + 1)]
+    prices = [price_model(day) for day in days]
+
+    candidates = []
+    for holding in holdings:
+        first_sale_date = holding.first_sale_date()
+        best_days = {}
+        for day, price in zip(days, prices):
+            if day < first_sale_date or day.year not in years:
+                continue
+            if day.year not in best_days or price > best_days[day.year][1]:
+                best_days[day.year] = (day, price)
+
+        options = []
+        for year, (day, price) in best_days.items():
+            sale = Event(
+                day,
+                "sale",
+                holding.option_type,
+                holding.quantity,
+                holding.exercise_price,
+            )
+            sale.price = price
+            options.append((year, sale, sale.capital_gain(), sale.cash()))
+        candidates.append(options)
+
+    if any(not options for options in candidates):
+        raise ValueError("a holding has no eligible sale date")
+
+    # the tax of a year is convex in its capital gain, so while every gain is
+    # positive a holding can't cost less tax than it would alone in its year
+    convex = all(gain >= 0 for options in candidates for _, _, gain, _ in options)
+
+    def upper_bound(option):
+        year, _, gain, proceeds = option
+        if convex:
+            state = years[year]
+            return proceeds - state.tax(gain) + state.tax(0)
+
+        return proceeds - gain * (max_rate if gain < 0 else min_rate)
+
+    for options in candidates:
+        options.sort(key=upper_bound, reverse=True)
+
+    order = sorted(
+        range(len(holdings)),
+        key=lambda idx: upper_bound(candidates[idx][0]),
+        reverse=True,
+    )
+    # best possible contribution of the holdings not yet assigned
+    remaining = [0] * (len(order) + 1)
+    for depth in reversed(range(len(order))):
+        remaining[depth] = remaining[depth + 1] + upper_bound(
+            candidates[order[depth]][0]
+        )
+
+    best_cash = float("-inf")
+    best_sales = []
+    sales = []
+    nodes = 0
+
+    def traverse(depth, cash):
+        nonlocal best_cash, best_sales, nodes
+        nodes += 1
+
+        if depth == len(order):
+            if cash > best_cash:
+                best_cash = cash
+                best_sales = sales.copy()
+            return
+
+        for option in candidates[order[depth]]:
+            if cash + upper_bound(option) + remaining[depth + 1] <= best_cash:
+                # options are sorted by their bound, the rest can't do better
+                break
+
+            year, sale, gain, proceeds = option
+
+            state = years[year]
+            before = state.cash()
+            after = state.cash(gain, proceeds)
+            if cash - before + after + remaining[depth + 1] <= best_cash:
+                continue
+
+            state.capital_gain += gain
+            state.proceeds += proceeds
+            sales.append(sale)
+            traverse(depth + 1, cash - before + after)
+            sales.pop()
+            state.capital_gain -= gain
+            state.proceeds -= proceeds
+
+    traverse(0, sum(state.cash() for state in years.values()))
+
+    return {
+        "cash": int(best_cash),
+        "sales": sorted(best_sales, key=lambda sale: sale.date),
+        "nodes": nodes,
+    }
@@ -0,0 +1,110 @@
+from collections import Counter
+from typing import List
+
+from tax import FY, Event, FYSummary, evaluate_fy
+
+# how each part of a year's result moves cash
+COMPONENTS = [
+    ("sale_proceeds", 1),
+    ("exercise_cost", -1),
+    ("federal_income_tax", -1),
+    ("federal_amt_tax", -1),
+    ("ca_income_tax", -1),
+    ("state_income_tax", -1),
+    ("ca_amt_tax", -1),
+    ("capital_gain_tax", -1),
+    ("niit_tax", -1),
+]
+
+
+class ScheduleEvaluator:
+    """
+    Evaluates fiscal years of schedules, memoized by the year's events, so
+    years and event sets shared between schedules are only computed once.
+    Reuse one instance to rank many neighboring schedules.
+    """
+
+    def __init__(self, married, fys: List[FY]):
+        self.married = married
+        self.fys = sorted(fys, key=lambda fy: fy.date)
+        self.cache = {}
+
+    def evaluate(self, fy: FY, events: List[Event]):
+        key = (fy.date.year, frozenset(Counter(e.key() for e in events).items()))
+        if key not in self.cache:
+            result = evaluate_fy(self.married, FYSummary(fy, events))
+            # capital_gain_tax includes the NIIT and state_income_tax the CA
+            # income tax, which are their own components
+            self.cache[key] = {
+                **result,
+                "capital_gain_tax": result["capital_gain_tax"] - result["niit_tax"],
+                "state_income_tax": result["state_income_tax"]
+                - result["ca_income_tax"],
+            }
+        return self.cache[key]
+
+    def diff(self, events_a: List[Event], events_b: List[Event]):
+        """
+        Change in cash going from events_a to events_b, by year, by component
+        (the components add up to the change) and by the events only one
+        schedule has. Each event is credited with what removing it from its
+        own schedule would cost; interaction is what those credits miss.
+        """
+        years = []
+        events = []
+        components = {name: 0 for name, _ in COMPONENTS}
+        for fy in self.fys:
+            year_a = [e for e in events_a if e.date.year == fy.date.year]
+            year_b = [e for e in events_b if e.date.year == fy.date.year]
+            only_a = Counter(e.key() for e in year_a) - Counter(e.key() for e in year_b)
+            only_b = Counter(e.key() for e in year_b) - Counter(e.key() for e in year_a)
+            if not only_a and not only_b:
+                continue
+
+            result_a = self.evaluate(fy, year_a)
+            result_b = self.evaluate(fy, year_b)
+            year = {
+                "year": result_b["year"],
+                "cash": result_b["cash"] - result_a["cash"],
+            }
+            for name, sign in COMPONENTS:
+                year[name] = sign * (result_b[name] - result_a[name])
+                components[name] += year[name]
+            years.append(year)
+
+            for schedule, year_events, only, sign in [
+                ("a", year_a, only_a, -1),
+                ("b", year_b, only_b, 1),
+            ]:
+                result = result_b if schedule == "b" else result_a
+                for e in year_events:
+                    if only[e.key()] == 0:
+                        continue
+                    only[e.key()] -= 1
+
+                    rest = list(year_events)
+                    rest.remove(e)
+                    events.append(
+                        {
+                            "schedule": schedule,
+                            "event": e,
+                            "year": result["year"],
+                            "cash": sign
+                            * (result["cash"] - self.evaluate(fy, rest)["cash"]),
+                        }
+                    )
+
+        cash = sum(year["cash"] for year in years)
+        return {
+            "cash": cash,
+            "components": components,
+            "years": years,
+            "events": events,
+            "interaction": cash - sum(event["cash"] for event in events),
+        }
+
+
+def diff_schedules(
+    married, fys: List[FY], events_a: List[Event], events_b: List[Event]
+):
+    return ScheduleEvaluator(married, fys).diff(events_a, events_b)
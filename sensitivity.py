@@ -0,0 +1,179 @@
+import copy
+from typing import List
+
+from tax import (
+    AMT_TAX_BRACKETS,
+    CAPITAL_GAIN_TAX_BRACKETS,
+    DEDUCTION,
+    FY,
+    INCOME_TAX_BRACKETS,
+    MEDICARE_TAX_BRACKETS,
+    SOCIAL_SECURITY_TAX_BRACKETS,
+    STATE_TAX_BRACKETS_BY_STATE,
+    Event,
+    FYSummary,
+    Model,
+    aggregate_year,
+    filing_status,
+    fy_values,
+)
+
+
+def shift_price(fy: FY, events: List[Event], amount):
+    shifted = [copy.copy(e) for e in events]
+    for e in shifted:
+        e.price += amount
+    return fy, shifted
+
+
+def shift_exercised_shares(fy: FY, events: List[Event], amount):
+    # spreads the extra shares over the year's exercises by their size; None
+    # for a year without exercises, which has nothing to spread them over
+    exercised = sum(
+        e.quantity
+        for e in events
+        if "exercise" in e.txn_type and e.date.year == fy.date.year
+    )
+    if not exercised:
+        return None
+    shifted = [copy.copy(e) for e in events]
+    for e in shifted:
+        if "exercise" in e.txn_type and e.date.year == fy.date.year:
+            e.quantity += amount * e.quantity / exercised
+    return fy, shifted
+
+
+def shift_salary(fy: FY, events: List[Event], amount):
+    shifted = copy.copy(fy)
+    shifted.salary += amount
+    return shifted, events
+
+
+# parameter name, unit of the reported slope, perturbation
+PARAMETERS = [
+    ("price", 1, shift_price),
+    ("exercised_shares", 1000, shift_exercised_shares),
+    ("salary", 10000, shift_salary),
+]
+
+
+def get_near_brackets(married, summary: FYSummary, margin):
+    m = Model(married)
+    joint_income = summary.joint_income(m.married)
+    incomes = [joint_income]
+    if not m.married:
+        incomes.append(summary.spouse_income)
+
+    # each state's brackets apply to the joint income, for the states the
+    # year's income is sourced to
+    amounts = [
+        (f"{state.lower()}_income", tax_brackets_map[m.status], joint_income)
+        for state, income in summary.state_incomes.items()
+        if income
+        for tax_brackets_map in STATE_TAX_BRACKETS_BY_STATE.get(state, [])
+    ]
+    amounts += [
+        ("amt", AMT_TAX_BRACKETS[m.status], joint_income + summary.iso_spreads),
+        # only the top capital gain threshold is modeled
+        (
+            "capital_gain",
+            CAPITAL_GAIN_TAX_BRACKETS[m.status][2:],
+            joint_income + summary.capital_gain,
+        ),
+    ]
+    for income in incomes:
+        taxable = income - DEDUCTION[m.status]
+        amounts += [
+            ("federal_income", INCOME_TAX_BRACKETS[m.status], taxable),
+            ("social_security", SOCIAL_SECURITY_TAX_BRACKETS[m.status], taxable),
+            ("medicare", MEDICARE_TAX_BRACKETS[m.status], taxable),
+        ]
+
+    near = []
+    for name, tax_brackets, amount in amounts:
+        for tax_rate in tax_brackets:
+            distance = tax_rate.threshold - amount
+            if tax_rate.threshold > 0 and abs(distance) <= margin:
+                near.append(
+                    {
+                        "bracket": name,
+                        "threshold": tax_rate.threshold,
+                        "rate": tax_rate.rate,
+                        "distance": int(distance),
+                    }
+                )
+    return near
+
+
+def evaluate_scenario(status, fy: FY, events: List[Event]):
+    return fy_values(
+        status, fy, aggregate_year([e for e in events if e.date.year == fy.date.year])
+    )
+
+
+def get_sensitivities(married, fy: FY, events: List[Event], margin=10000):
+    """
+    Central differences of cash and eff_tax_rate for each of PARAMETERS, one
+    unit up and one unit down. A parameter that doesn't apply to the year
+    (e.g. exercised_shares without exercises) is reported as None.
+
+    Every perturbed scenario of the year goes through the fused fy_values
+    kernel, one after the other. They aren't evaluated as one vectorized
+    array: a year has only seven scenarios, too few for numpy to beat the
+    scalar kernel.
+    """
+    status = filing_status(married)
+    scenarios = [(fy, events)]
+    for _, unit, shift in PARAMETERS:
+        scenarios += [shift(fy, events, -unit), shift(fy, events, unit)]
+    values = [
+        None if scenario is None else evaluate_scenario(status, *scenario)
+        for scenario in scenarios
+    ]
+
+    base = values[0]
+    rows = []
+    for idx, (name, unit, _) in enumerate(PARAMETERS):
+        row = {
+            "year": str(fy.date.year),
+            "status": status,
+            "parameter": name,
+            "unit": unit,
+            "cash_low": None,
+            "cash": int(base.cash),
+            "cash_high": None,
+            "cash_slope": None,
+            "eff_tax_rate_slope": None,
+        }
+        low, high = values[2 * idx + 1], values[2 * idx + 2]
+        if low is not None and high is not None:
+            row.update(
+                {
+                    "cash_low": int(low.cash),
+                    "cash_high": int(high.cash),
+                    "cash_slope": (high.cash - low.cash) / 2,
+                    "eff_tax_rate_slope": (high.eff_tax_rate - low.eff_tax_rate) / 2,
+                }
+            )
+        rows.append(row)
+
+    return {
+        "year": str(fy.date.year),
+        "status": status,
+        "sensitivities": rows,
+        "near_brackets": get_near_brackets(married, FYSummary(fy, events), margin),
+    }
+
+
+def get_schedule_sensitivities(
+    married, fys: List[FY], events: List[Event], margin=10000
+):
+    # flat rows, one per year and parameter, e.g. for a tornado chart of
+    # cash_low / cash_high around cash
+    rows = []
+    near_brackets = {}
+    for fy in fys:
+        result = get_sensitivities(married, fy, events, margin)
+        rows += result["sensitivities"]
+        near_brackets[result["year"]] = result["near_brackets"]
+    return rows, near_brackets
@@ -1,4 +1,8 @@
+from bisect import bisect_right
+from collections import namedtuple
+import copy
 from datetime import datetime
+from functools import lru_cache
 import streamlit as st
 from typing import List
 import numpy as np
@@ -12,8 +16,11 @@ from tax_rates import (
     NIIT_TAX_BRACKETS,
     SOCIAL_SECURITY_TAX_BRACKETS,
     STATE_TAX_BRACKETS,
+    STATE_TAX_BRACKETS_BY_STATE,
     TaxRate,
 )
+from residency import Residency
+from vesting import Grant, vested_income
 
 
 def to_date(date_expr) -> datetime:
@@ -32,19 +39,36 @@ END_DATE = to_date("Mar 15 2025")
 MOVE_DATE_PRICE = 35.0
 END_DATE_PRICE = 80.0
 
+RESIDENCY = Residency(
+    [("CA", GRANT_DATE), ("other", MOVE_DATE)], to_date("Dec 31 2030")
+)
+
+
+@lru_cache(maxsize=None)
+def source_ratios(date: datetime):
+    # option income is sourced by the workdays between grant and exercise;
+    # cached per day since schedules exercise on the same days
+    return {
+        state: RESIDENCY.ratio(state, GRANT_DATE, date) for state in RESIDENCY.states
+    }
+
+
+def linear_price(date: datetime) -> float:
+    return round(
+        (END_DATE_PRICE - MOVE_DATE_PRICE)
+        * (date - MOVE_DATE).days
+        / (END_DATE - MOVE_DATE).days
+        + MOVE_DATE_PRICE,
+        2,
+    )
+
 
 class Event:
-    def __init__(self, date: str, txn_type, option_type, quantity, exercise_price=None):
+    def __init__(self, date, txn_type, option_type, quantity, exercise_price=None):
         self.option_type = option_type
         self.quantity = quantity
-        self.date = to_date(date)
-        self.price = round(
-            (END_DATE_PRICE - MOVE_DATE_PRICE)
-            * (self.date - MOVE_DATE).days
-            / (END_DATE - MOVE_DATE).days
-            + MOVE_DATE_PRICE,
-            2,
-        )
+        self.date = date if isinstance(date, datetime) else to_date(date)
+        self.price = linear_price(self.date)
         self.txn_type = txn_type
         self.exercise_price = exercise_price
 
@@ -63,11 +87,14 @@ class Event:
 
         return (self.price - self.exercise_price) * self.quantity
 
-    def ca_ratio(self):
+    def state_ratio(self, state):
         if self.txn_type == "sale":
             return 0
 
-        return (MOVE_DATE - GRANT_DATE).days * 1.0 / (self.date - GRANT_DATE).days
+        return source_ratios(self.date).get(state, 0)
+
+    def ca_ratio(self):
+        return self.state_ratio("CA")
 
     def cost(self):
         return int(STRIKE_PRICE * self.quantity if "exercise" in self.txn_type else 0)
@@ -75,6 +102,16 @@ class Event:
     def cash(self):
         return int(self.price * self.quantity if "sale" in self.txn_type else 0)
 
+    def key(self):
+        return (
+            self.date,
+            self.txn_type,
+            self.option_type,
+            self.quantity,
+            self.exercise_price,
+            self.price,
+        )
+
     def json(self):
         return {**self.__dict__, "cash": self.cash(), "cost": self.cost()}
 
@@ -87,12 +124,15 @@ class FY:
         spouse_salary,
         vested_rsu,
         spouse_vested_rsu,
+        state_income=None,
     ):
         self.date = to_date(date)
         self.salary = salary
         self.spouse_salary = spouse_salary
         self.vested_rsu = vested_rsu
         self.spouse_vested_rsu = spouse_vested_rsu
+        # income sourced to a state besides options, e.g. salary before a move
+        self.state_income = state_income or {}
         pass
 
 
@@ -103,6 +143,7 @@ FYS = {
         141900 * 2 / 12 + 120615 * 10 / 12 + 37500,
         236000 * 3 / 16,
         0,
+        {"CA": 230000 * 2 / 12 + 270000 * 0.15 + 37500 + 141900 * 1 / 12},
     ),
     "2023": FY(
         "Dec 31 2023",
@@ -128,28 +169,56 @@ FYS = {
 }
 
 
+def get_vested_fys(fys: List[FY], grants: List[Grant], spouse_grants: List[Grant] = ()):
+    # copies of fys with vested_rsu and spouse_vested_rsu generated from grants
+    # (sized in dollars) instead of hand-computed fractions
+    years = [fy.date.year for fy in fys]
+    vested = vested_income(grants, years) if grants else np.zeros(len(fys))
+    spouse_vested = (
+        vested_income(spouse_grants, years) if spouse_grants else np.zeros(len(fys))
+    )
+
+    vested_fys = []
+    for idx, fy in enumerate(fys):
+        vested_fy = copy.copy(fy)
+        vested_fy.vested_rsu = float(vested[idx])
+        vested_fy.spouse_vested_rsu = float(spouse_vested[idx])
+        vested_fys.append(vested_fy)
+    return vested_fys
+
+
+FILING_STATUSES = ["married", "single", "married_separately"]
+
+
+def filing_status(married) -> str:
+    if isinstance(married, str):
+        return married
+
+    return "married" if married else "single"
+
+
 class Model:
     def __init__(self, married) -> None:
-        self.married = married
+        self.status = filing_status(married)
+        self.married = self.status == "married"
         pass
 
     def get_tax(self, tax_brackets_map, amount: float):
         tax = 0
-        tax_brackets: List[TaxRate] = tax_brackets_map[
-            "married" if self.married else "single"
-        ]
-        for idx in range(len(tax_brackets)):
+        tax_brackets: List[TaxRate] = tax_brackets_map[self.status]
+        last = len(tax_brackets) - 1
+        for idx, tax_rate in enumerate(tax_brackets):
             if amount == 0.0:
                 return tax
 
-            upper = (
-                tax_brackets[idx + 1].threshold
-                if idx < len(tax_brackets) - 1
-                else float("inf")
-            )
-            diff = min(amount, upper - tax_brackets[idx].threshold)
+            # the top bracket takes whatever is left
+            diff = amount
+            if idx < last:
+                width = tax_brackets[idx + 1].threshold - tax_rate.threshold
+                if width < amount:
+                    diff = width
             amount -= diff
-            tax += diff * tax_brackets[idx].rate
+            tax += diff * tax_rate.rate
         return tax
 
     def get_fica_tax(self, amount):
@@ -158,137 +227,606 @@ class Model:
         )
 
     def get_federal_income_tax(self, amount):
-        taxable = amount - DEDUCTION["married" if self.married else "single"]
+        taxable = amount - DEDUCTION[self.status]
         return self.get_fica_tax(taxable) + self.get_tax(INCOME_TAX_BRACKETS, taxable)
 
+    def get_regular_tax(self, amount):
+        # federal income tax without FICA, what the minimum tax is compared to
+        return self.get_tax(INCOME_TAX_BRACKETS, amount - DEDUCTION[self.status])
+
+    def get_amt_tax(self, amount):
+        return self.get_tax(AMT_TAX_BRACKETS, amount)
+
+    def get_ca_amt_tax(self, amount):
+        return self.get_tax(CA_AMT_TAX_BRACKETS, amount)
+
     def get_niit_tax(self, amount):
         return self.get_tax(NIIT_TAX_BRACKETS, amount)
 
-    def get_state_tax(self, amount):
-        return self.get_tax(STATE_TAX_BRACKETS, amount) + 0.01 * max(
-            0, amount - 1000000
+    def get_capital_gain_tax(self, capital_gain, income):
+        brackets = CAPITAL_GAIN_TAX_BRACKETS[self.status]
+        first_part = max(0, brackets[2].threshold - income)
+        first_part = min(capital_gain, first_part)
+        second_part = max(0, capital_gain - first_part)
+        return second_part * brackets[2].rate + first_part * brackets[1].rate
+
+    def get_state_tax(self, amount, state="CA"):
+        return sum(
+            self.get_tax(tax_brackets_map, amount)
+            for tax_brackets_map in STATE_TAX_BRACKETS_BY_STATE.get(state, [])
         )
 
 
-def get_fy_projection(married, fy: FY, events: List[Event]):
-    events = [e for e in events if e.date.year == fy.date.year]
-    m = Model(married)
-
-    self_income = fy.salary + fy.vested_rsu + sum(e.income() for e in events)
+# event totals of a fiscal year, before the FY's own salary and RSUs;
+# state_incomes is the option income sourced to each state
+FYAggregate = namedtuple(
+    "FYAggregate",
+    [
+        "income",
+        "state_incomes",
+        "iso_spreads",
+        "ca_iso_spreads",
+        "capital_gain",
+        "sale_proceeds",
+        "exercise_cost",
+    ],
+)
 
-    self_ca_income = sum(e.income() * e.ca_ratio() for e in events)
-    if fy.date.year == 2022:
-        self_ca_income += 230000 * 2 / 12 + 270000 * 0.15 + 37500 + 141900 * 1 / 12
 
-    spouse_income = fy.spouse_salary + fy.spouse_vested_rsu
+def summarize_events(events: List[Event]) -> FYAggregate:
+    income = capital_gain = sale_proceeds = exercise_cost = 0
+    state_incomes = dict.fromkeys(RESIDENCY.states, 0)
+    for e in events:
+        event_income = e.income()
+        income += event_income
+        if event_income:
+            for state, ratio in source_ratios(e.date).items():
+                state_incomes[state] += event_income * ratio
+        capital_gain += e.capital_gain()
+        sale_proceeds += e.cash()
+        exercise_cost += e.cost()
 
-    federal_income_tax = 0
     iso_exercises = [
         e for e in events if e.option_type == "iso" and e.txn_type == "exercise"
     ]
-    iso_spreads = sum((e.price - STRIKE_PRICE) * e.quantity for e in iso_exercises)
+    return FYAggregate(
+        income=income,
+        state_incomes=state_incomes,
+        iso_spreads=sum((e.price - STRIKE_PRICE) * e.quantity for e in iso_exercises),
+        ca_iso_spreads=sum(
+            (e.price - STRIKE_PRICE) * e.quantity * e.ca_ratio() for e in iso_exercises
+        ),
+        capital_gain=capital_gain,
+        sale_proceeds=sale_proceeds,
+        exercise_cost=exercise_cost,
+    )
 
-    # get effective tax rate first and then apply to CA portion of income
 
-    if married:
-        ca_income_tax = (
-            m.get_state_tax(self_income + spouse_income)
-            / (self_income + spouse_income)
-            * self_ca_income
-        )
-    else:
-        ca_income_tax = m.get_state_tax(self_income) / self_income * self_ca_income
+class FYSummary:
+    # event aggregates of a fiscal year, shared by every filing status
+    def __init__(self, fy: FY, events: List[Event]):
+        aggregate = summarize_events([e for e in events if e.date.year == fy.date.year])
+        self.fy = fy
 
-    ca_amt_tax = max(
-        0,
-        m.get_tax(
-            CA_AMT_TAX_BRACKETS,
-            sum(
-                (e.price - STRIKE_PRICE) * e.quantity * e.ca_ratio()
-                for e in iso_exercises
+        self.self_income = fy.salary + fy.vested_rsu + aggregate.income
+
+        self.state_incomes = {
+            state: fy.state_income.get(state, 0) + aggregate.state_incomes.get(state, 0)
+            for state in dict.fromkeys(
+                list(aggregate.state_incomes) + list(fy.state_income)
             )
-            + self_ca_income,
-        )
-        - ca_income_tax,
+        }
+        self.self_ca_income = self.state_incomes.get("CA", 0)
+
+        self.spouse_income = fy.spouse_salary + fy.spouse_vested_rsu
+
+        self.iso_spreads = aggregate.iso_spreads
+        self.ca_iso_spreads = aggregate.ca_iso_spreads
+
+        self.capital_gain = aggregate.capital_gain
+        self.sale_proceeds = aggregate.sale_proceeds
+        self.exercise_cost = aggregate.exercise_cost
+
+    def joint_income(self, married):
+        # married filing jointly is the only status that pools both incomes
+        return self.self_income + self.spouse_income if married else self.self_income
+
+
+def evaluate_fy(married, summary: FYSummary):
+    m = Model(married)
+    fy = summary.fy
+    self_income = summary.self_income
+    spouse_income = summary.spouse_income
+    joint_income = summary.joint_income(m.married)
+
+    # get effective tax rate first and then apply to each state's portion of income
+    state_income_taxes = {
+        state: m.get_state_tax(joint_income, state) / joint_income * income
+        for state, income in summary.state_incomes.items()
+    }
+    state_income_tax = sum(state_income_taxes.values())
+    ca_income_tax = state_income_taxes.get("CA", 0)
+
+    ca_tentative_amt_tax = m.get_ca_amt_tax(
+        summary.ca_iso_spreads + summary.self_ca_income
     )
+    ca_amt_tax = max(0, ca_tentative_amt_tax - ca_income_tax)
+
+    # FICA plus the regular tax, without walking the income brackets twice
+    regular_tax = m.get_regular_tax(joint_income)
+    federal_income_tax = (
+        m.get_fica_tax(joint_income - DEDUCTION[m.status]) + regular_tax
+    )
+    if not m.married:
+        federal_income_tax += m.get_federal_income_tax(spouse_income)
+    tentative_amt_tax = m.get_amt_tax(joint_income + summary.iso_spreads)
+
+    federal_amt_tax = max(0, tentative_amt_tax - federal_income_tax)
+
+    capital_gain = summary.capital_gain
+    niit_tax = m.get_niit_tax(capital_gain)
+    capital_gain_tax = m.get_capital_gain_tax(capital_gain, joint_income) + niit_tax
+
+    cash = (
+        fy.salary
+        + fy.vested_rsu
+        + spouse_income
+        + summary.sale_proceeds
+        - summary.exercise_cost
+        - federal_income_tax
+        - federal_amt_tax
+        - capital_gain_tax
+        - state_income_tax
+        - ca_amt_tax
+    )
+    return {
+        "year": str(fy.date.year),
+        "cash": cash,
+        "status": m.status,
+        "family_income": self_income + spouse_income,
+        "capital_gain": capital_gain,
+        "sale_proceeds": summary.sale_proceeds,
+        "exercise_cost": summary.exercise_cost,
+        "total_tax": federal_income_tax
+        + federal_amt_tax
+        + capital_gain_tax
+        + state_income_tax
+        + ca_amt_tax,
+        "federal_income_tax": federal_income_tax,
+        "ca_income_tax": ca_income_tax,
+        "state_income_tax": state_income_tax,
+        "state_income_taxes": state_income_taxes,
+        "capital_gain_tax": capital_gain_tax,
+        "niit_tax": niit_tax,
+        "federal_amt_tax": federal_amt_tax,
+        "ca_amt_tax": ca_amt_tax,
+        "regular_tax": regular_tax,
+        "tentative_amt_tax": tentative_amt_tax,
+        "ca_tentative_amt_tax": ca_tentative_amt_tax,
+    }
+
+
+def eff_tax_rate(result):
+    return result["total_tax"] / (result["family_income"] + result["capital_gain"])
 
-    amt_tax = 0
-    if married:
-        federal_income_tax = m.get_federal_income_tax(self_income + spouse_income)
-        amt_tax = m.get_tax(
-            AMT_TAX_BRACKETS,
-            self_income
-            + spouse_income
-            + sum((e.price - STRIKE_PRICE) * e.quantity for e in iso_exercises),
+
+def format_projection(result):
+    return {
+        "year": result["year"],
+        "cash": int(result["cash"]),
+        "status": result["status"],
+        "family_income": int(result["family_income"]),
+        "capital_gain": int(result["capital_gain"]),
+        "eff_tax_rate": round(float(eff_tax_rate(result)), 2),
+        "federal_income_tax": int(result["federal_income_tax"]),
+        "ca_income_tax": int(result["ca_income_tax"]),
+        "capital_gain_tax": int(result["capital_gain_tax"]),
+        "federal_amt_tax": int(result["federal_amt_tax"]),
+        "ca_amt_tax": int(result["ca_amt_tax"]),
+        **{key: int(result[key]) for key in AMT_CREDIT_KEYS if key in result},
+    }
+
+
+def get_fy_projection(married, fy: FY, events: List[Event]):
+    return format_projection(evaluate_fy(married, FYSummary(fy, events)))
+
+
+def get_filing_comparison(fys: List[FY], events: List[Event], statuses=None):
+    # event aggregates are computed once per year and reused for every status
+    statuses = statuses or FILING_STATUSES
+    projections = []
+    optimal = {}
+    for fy in fys:
+        summary = FYSummary(fy, events)
+        rows = [format_projection(evaluate_fy(status, summary)) for status in statuses]
+        best = max(rows, key=lambda row: row["cash"])
+        optimal[best["year"]] = best["status"]
+        projections += [{**row, "optimal": row is best} for row in rows]
+
+    return projections, optimal
+
+
+AMT_CREDIT_KEYS = [
+    "amt_credit_used",
+    "amt_credit",
+    "ca_amt_credit_used",
+    "ca_amt_credit",
+]
+
+
+def apply_amt_credits(results):
+    # results are evaluate_fy outputs in year order; the values may be floats or
+    # arrays holding one entry per schedule, so one pass covers every schedule
+    amt_credit = 0
+    ca_amt_credit = 0
+    credited = []
+    for result in results:
+        # AMT paid in earlier years is recovered only down to this year's AMT
+        amt_credit_used = np.minimum(
+            amt_credit,
+            np.maximum(0, result["regular_tax"] - result["tentative_amt_tax"]),
         )
-    else:
-        federal_income_tax = m.get_federal_income_tax(
-            self_income
-        ) + m.get_federal_income_tax(spouse_income)
-        amt_tax = m.get_tax(
-            AMT_TAX_BRACKETS,
-            self_income + iso_spreads,
+        ca_amt_credit_used = np.minimum(
+            ca_amt_credit,
+            np.maximum(0, result["ca_income_tax"] - result["ca_tentative_amt_tax"]),
+        )
+        amt_credit = amt_credit - amt_credit_used + result["federal_amt_tax"]
+        ca_amt_credit = ca_amt_credit - ca_amt_credit_used + result["ca_amt_tax"]
+
+        credit = amt_credit_used + ca_amt_credit_used
+        credited.append(
+            {
+                **result,
+                "cash": result["cash"] + credit,
+                "total_tax": result["total_tax"] - credit,
+                "amt_credit_used": amt_credit_used,
+                "amt_credit": amt_credit,
+                "ca_amt_credit_used": ca_amt_credit_used,
+                "ca_amt_credit": ca_amt_credit,
+            }
+        )
+
+    return credited
+
+
+def get_multi_year_projection(married, fys: List[FY], events: List[Event]):
+    fys = sorted(fys, key=lambda fy: fy.date)
+    results = [evaluate_fy(married, FYSummary(fy, events)) for fy in fys]
+    return [format_projection(result) for result in apply_amt_credits(results)]
+
+
+def get_multi_year_projections(married, fys: List[FY], schedules):
+    # stacks every schedule into one array per numeric field so that the
+    # credit carry runs once over the whole batch instead of once per schedule
+    fys = sorted(fys, key=lambda fy: fy.date)
+    results = []
+    for fy in fys:
+        rows = [evaluate_fy(married, FYSummary(fy, events)) for events in schedules]
+        results.append(
+            {
+                **{
+                    key: np.array([row[key] for row in rows])
+                    for key, value in rows[0].items()
+                    if isinstance(value, (int, float))
+                },
+                "year": str(fy.date.year),
+                "status": filing_status(married),
+            }
         )
 
-    federal_amt_tax = max(0, amt_tax - federal_income_tax)
+    return apply_amt_credits(results)
 
-    capital_gain = sum(e.capital_gain() for e in events)
-    first_part = 0
-    if married:
-        first_part = max(
-            0,
-            CAPITAL_GAIN_TAX_BRACKETS["married"][2].threshold
-            - self_income
-            - spouse_income,
+
+def bracket_table(schedules: List[List[TaxRate]], offset=0):
+    # sum of several bracket schedules as one piecewise-linear table of
+    # thresholds, tax owed at each threshold and marginal rates, with the
+    # thresholds moved by offset (e.g. a deduction)
+    thresholds = sorted(
+        {tax_rate.threshold for tax_brackets in schedules for tax_rate in tax_brackets}
+    )
+    rates = [
+        sum(
+            [tax_rate for tax_rate in tax_brackets if tax_rate.threshold <= threshold][
+                -1
+            ].rate
+            for tax_brackets in schedules
+        )
+        for threshold in thresholds
+    ]
+    bases = [0]
+    for idx in range(1, len(thresholds)):
+        bases.append(
+            bases[-1] + (thresholds[idx] - thresholds[idx - 1]) * rates[idx - 1]
         )
+
+    # Model.get_tax taxes negative amounts at the first bracket's rate
+    below = sum(tax_brackets[0].rate for tax_brackets in schedules)
+    return [threshold + offset for threshold in thresholds], bases, rates, below
+
+
+BRACKET_TABLES = {
+    status: {
+        "federal": bracket_table(
+            [
+                SOCIAL_SECURITY_TAX_BRACKETS[status],
+                MEDICARE_TAX_BRACKETS[status],
+                INCOME_TAX_BRACKETS[status],
+            ],
+            DEDUCTION[status],
+        ),
+        "amt": bracket_table([AMT_TAX_BRACKETS[status]]),
+        "ca_amt": bracket_table([CA_AMT_TAX_BRACKETS[status]]),
+        "niit": bracket_table([NIIT_TAX_BRACKETS[status]]),
+        "states": {
+            state: bracket_table(
+                [tax_brackets_map[status] for tax_brackets_map in tax_brackets_maps]
+            )
+            for state, tax_brackets_maps in STATE_TAX_BRACKETS_BY_STATE.items()
+        },
+    }
+    for status in FILING_STATUSES
+}
+
+
+def table_tax(table, amount):
+    # same as Model.get_tax, in one lookup instead of a walk over the brackets
+    thresholds, bases, rates, below = table
+    if amount < thresholds[0]:
+        return (amount - thresholds[0]) * below
+
+    idx = bisect_right(thresholds, amount) - 1
+    return bases[idx] + (amount - thresholds[idx]) * rates[idx]
+
+
+def aggregate_events(events: List[Event]):
+    # same as summarize_events for every year, in a single pass over events
+    by_year = {}
+    for e in events:
+        by_year.setdefault(e.date.year, []).append(e)
+    return {year: aggregate_year(year_events) for year, year_events in by_year.items()}
+
+
+def aggregate_year(events: List[Event]) -> FYAggregate:
+    income = iso_spreads = ca_iso_spreads = capital_gain = proceeds = cost = 0
+    state_incomes = dict.fromkeys(RESIDENCY.states, 0)
+    for e in events:
+        txn_type = e.txn_type
+        if txn_type == "sale":
+            capital_gain += (
+                e.price - (STRIKE_PRICE if e.option_type == "iso" else e.exercise_price)
+            ) * e.quantity
+            proceeds += int(e.price * e.quantity)
+            continue
+
+        spread = (e.price - STRIKE_PRICE) * e.quantity
+        if e.option_type != "iso":
+            income += spread
+            for state, ratio in source_ratios(e.date).items():
+                state_incomes[state] += spread * ratio
+        elif txn_type == "exercise":
+            iso_spreads += spread
+            ca_iso_spreads += spread * source_ratios(e.date).get("CA", 0)
+        # every other transaction is an exercise, with no capital gain
+        cost += int(STRIKE_PRICE * e.quantity)
+        if "sale" in txn_type:
+            proceeds += int(e.price * e.quantity)
+
+    return FYAggregate(
+        income,
+        state_incomes,
+        iso_spreads,
+        ca_iso_spreads,
+        capital_gain,
+        proceeds,
+        cost,
+    )
+
+
+NO_EVENTS = aggregate_year([])
+
+
+# unrounded projection of a fiscal year for one filing status
+FYValues = namedtuple(
+    "FYValues",
+    [
+        "cash",
+        "family_income",
+        "capital_gain",
+        "eff_tax_rate",
+        "federal_income_tax",
+        "ca_income_tax",
+        "state_income_tax",
+        "capital_gain_tax",
+        "niit_tax",
+        "federal_amt_tax",
+        "ca_amt_tax",
+        "total_tax",
+    ],
+)
+
+
+def fy_values(status, fy: FY, aggregate: FYAggregate) -> FYValues:
+    """
+    Numeric counterpart of evaluate_fy: each schedule is one lookup in
+    BRACKET_TABLES, and only the FYValues are built. evaluate_fy stays the
+    reference, and benchmark.py checks the two agree.
+    """
+    tables = BRACKET_TABLES[status]
+    self_income = fy.salary + fy.vested_rsu + aggregate.income
+    spouse_income = fy.spouse_salary + fy.spouse_vested_rsu
+    family_income = self_income + spouse_income
+    if status == "married":
+        joint_income = family_income
+        federal_income_tax = table_tax(tables["federal"], family_income)
     else:
-        first_part = max(
-            0, CAPITAL_GAIN_TAX_BRACKETS["single"][2].threshold - self_income
+        joint_income = self_income
+        federal_income_tax = table_tax(tables["federal"], self_income) + table_tax(
+            tables["federal"], spouse_income
         )
 
-    first_part = min(capital_gain, first_part)
-    second_part = max(0, capital_gain - first_part)
+    # only taxed states add anything, whatever the income sourced elsewhere
+    state_income_tax = ca_income_tax = 0
+    for state, table in tables["states"].items():
+        income = fy.state_income.get(state, 0) + aggregate.state_incomes.get(state, 0)
+        if income:
+            tax = table_tax(table, joint_income) / joint_income * income
+            state_income_tax += tax
+            if state == "CA":
+                ca_income_tax = tax
+
+    ca_income = fy.state_income.get("CA", 0) + aggregate.state_incomes.get("CA", 0)
+    ca_amt_tax = (
+        table_tax(tables["ca_amt"], aggregate.ca_iso_spreads + ca_income)
+        - ca_income_tax
+    )
+    if ca_amt_tax < 0:
+        ca_amt_tax = 0
+
+    federal_amt_tax = (
+        table_tax(tables["amt"], joint_income + aggregate.iso_spreads)
+        - federal_income_tax
+    )
+    if federal_amt_tax < 0:
+        federal_amt_tax = 0
 
+    capital_gain = aggregate.capital_gain
+    capital_gain_brackets = CAPITAL_GAIN_TAX_BRACKETS[status]
+    first_part = min(
+        capital_gain, max(0, capital_gain_brackets[2].threshold - joint_income)
+    )
+    niit_tax = table_tax(tables["niit"], capital_gain)
     capital_gain_tax = (
-        second_part * CAPITAL_GAIN_TAX_BRACKETS["single"][2].rate
-        + first_part * CAPITAL_GAIN_TAX_BRACKETS["single"][1].rate
-    ) + m.get_niit_tax(capital_gain)
+        max(0, capital_gain - first_part) * capital_gain_brackets[2].rate
+        + first_part * capital_gain_brackets[1].rate
+        + niit_tax
+    )
 
-    cash = (
-        fy.salary
+    total_tax = (
+        federal_income_tax
+        + federal_amt_tax
+        + capital_gain_tax
+        + state_income_tax
+        + ca_amt_tax
+    )
+    return FYValues(
+        cash=fy.salary
         + fy.vested_rsu
         + spouse_income
-        + sum(e.cash() for e in events)
-        - sum(e.cost() for e in events)
-        - federal_income_tax
-        - federal_amt_tax
-        - capital_gain_tax
-        - ca_income_tax
-        - ca_amt_tax
+        + aggregate.sale_proceeds
+        - aggregate.exercise_cost
+        - total_tax,
+        family_income=family_income,
+        capital_gain=capital_gain,
+        eff_tax_rate=total_tax / (family_income + capital_gain),
+        federal_income_tax=federal_income_tax,
+        ca_income_tax=ca_income_tax,
+        state_income_tax=state_income_tax,
+        capital_gain_tax=capital_gain_tax,
+        niit_tax=niit_tax,
+        federal_amt_tax=federal_amt_tax,
+        ca_amt_tax=ca_amt_tax,
+        total_tax=total_tax,
     )
+
+
+def format_values(status, fy: FY, values: FYValues):
+    # same dict as format_projection
     return {
         "year": str(fy.date.year),
-        "cash": int(cash),
-        "status": "married" if married else "single",
-        "family_income": int(self_income + spouse_income),
-        "capital_gain": int(capital_gain),
-        "eff_tax_rate": round(
+        "cash": int(values.cash),
+        "status": status,
+        "family_income": int(values.family_income),
+        "capital_gain": int(values.capital_gain),
+        "eff_tax_rate": round(values.eff_tax_rate, 2),
+        "federal_income_tax": int(values.federal_income_tax),
+        "ca_income_tax": int(values.ca_income_tax),
+        "capital_gain_tax": int(values.capital_gain_tax),
+        "federal_amt_tax": int(values.federal_amt_tax),
+        "ca_amt_tax": int(values.ca_amt_tax),
+    }
+
+
+def get_fy_projection_fused(married, fy: FY, events: List[Event]):
+    """
+    Same result as get_fy_projection, aggregating the events in a single pass
+    and evaluating the year with fy_values.
+    """
+    status = filing_status(married)
+    aggregate = aggregate_year([e for e in events if e.date.year == fy.date.year])
+    return format_values(status, fy, fy_values(status, fy, aggregate))
+
+
+def get_projections_fused(fys: List[FY], events: List[Event], statuses=None):
+    # aggregates the whole schedule once for every year and filing status
+    aggregates = aggregate_events(events)
+    return [
+        format_values(
+            status, fy, fy_values(status, fy, aggregates.get(fy.date.year, NO_EVENTS))
+        )
+        for fy in fys
+        for status in statuses or FILING_STATUSES
+    ]
+
+
+# cash is salaries, RSUs and sale proceeds less exercise cost and total_tax,
+# which is federal_income_tax + federal_amt_tax + capital_gain_tax (including
+# niit_tax) + state_income_tax (including ca_income_tax) + ca_amt_tax
+PROJECTION_FIELDS = list(FYValues._fields)
+
+# status is the index of the filing status in FILING_STATUSES, schedule the
+# index of the schedule the row was projected from
+PROJECTION_DTYPE = np.dtype(
+    [("schedule", "i4"), ("year", "i2"), ("status", "u1")]
+    + [(field, "f8") for field in PROJECTION_FIELDS]
+)
+
+
+def get_projections_array(fys: List[FY], schedules, statuses=None):
+    # one PROJECTION_DTYPE row per schedule, year and filing status, with the
+    # unrounded FYValues and no dict per row
+    statuses = statuses or FILING_STATUSES
+    projections = np.empty(len(schedules) * len(fys) * len(statuses), PROJECTION_DTYPE)
+    idx = 0
+    for schedule, events in enumerate(schedules):
+        aggregates = aggregate_events(events)
+        for fy in fys:
+            aggregate = aggregates.get(fy.date.year, NO_EVENTS)
+            for status in statuses:
+                values = fy_values(status, fy, aggregate)
+                projections[idx] = (
+                    schedule,
+                    fy.date.year,
+                    FILING_STATUSES.index(status),
+                    *values,
+                )
+                idx += 1
+    return projections
+
+
+def projections_to_dataframe(projections):
+    import pandas as pd
+
+    df = pd.DataFrame(projections)
+    df["status"] = pd.Categorical.from_codes(df["status"], FILING_STATUSES)
+    return df
+
+
+def projections_to_arrow(projections):
+    import pyarrow as pa
+
+    return pa.RecordBatch.from_arrays(
+        [
             (
-                federal_income_tax
-                + federal_amt_tax
-                + capital_gain_tax
-                + ca_income_tax
-                + ca_amt_tax
+                pa.DictionaryArray.from_arrays(
+                    pa.array(projections[name], pa.int8()), FILING_STATUSES
+                )
+                if name == "status"
+                else pa.array(projections[name])
             )
-            / (self_income + spouse_income + capital_gain),
-            2,
-        ),
-        "federal_income_tax": int(federal_income_tax),
-        "ca_income_tax": int(ca_income_tax),
-        "capital_gain_tax": int(capital_gain_tax),
-        "federal_amt_tax": int(federal_amt_tax),
-        "ca_amt_tax": int(ca_amt_tax),
-    }
+            for name in PROJECTION_DTYPE.names
+        ],
+        names=list(PROJECTION_DTYPE.names),
+    )
 
 
 # import pandas as pd
@@ -4,7 +4,7 @@ class TaxRate:
         self.rate = rate / 100
 
 
-DEDUCTION = {"single": 12950, "married": 25900}
+DEDUCTION = {"single": 12950, "married": 25900, "married_separately": 12950}
 
 
 INCOME_TAX_BRACKETS = {
@@ -26,6 +26,15 @@ INCOME_TAX_BRACKETS = {
         TaxRate(215950, 35),
         TaxRate(539900, 37),
     ],
+    "married_separately": [
+        TaxRate(0, 10),
+        TaxRate(10275, 12),
+        TaxRate(41775, 22),
+        TaxRate(89075, 24),
+        TaxRate(170050, 32),
+        TaxRate(215950, 35),
+        TaxRate(323925, 37),
+    ],
 }
 
 
@@ -40,6 +49,11 @@ AMT_TAX_BRACKETS = {
         TaxRate(75900, 26),
         TaxRate(118100 + 206100, 28),
     ],
+    "married_separately": [
+        TaxRate(0, 0),
+        TaxRate(59050, 26),
+        TaxRate(59050 + 103050, 28),
+    ],
 }
 
 CA_AMT_TAX_BRACKETS = {
@@ -51,6 +65,10 @@ CA_AMT_TAX_BRACKETS = {
         TaxRate(0, 0),
         TaxRate(0, 7),
     ],
+    "married_separately": [
+        TaxRate(0, 0),
+        TaxRate(0, 7),
+    ],
 }
 
 CAPITAL_GAIN_TAX_BRACKETS = {
@@ -60,21 +78,25 @@ CAPITAL_GAIN_TAX_BRACKETS = {
         TaxRate(501601, 20),
     ],
     "single": [TaxRate(0, 0), TaxRate(40401, 15), TaxRate(445851, 20)],
+    "married_separately": [TaxRate(0, 0), TaxRate(41676, 15), TaxRate(258601, 20)],
 }
 
 SOCIAL_SECURITY_TAX_BRACKETS = {
     "married": [TaxRate(0, 6.2), TaxRate(147000, 0)],
     "single": [TaxRate(0, 6.2), TaxRate(147000, 0)],
+    "married_separately": [TaxRate(0, 6.2), TaxRate(147000, 0)],
 }
 
 MEDICARE_TAX_BRACKETS = {
     "married": [TaxRate(0, 1.45), TaxRate(250000, 2.35)],
     "single": [TaxRate(0, 1.45), TaxRate(200000, 2.35)],
+    "married_separately": [TaxRate(0, 1.45), TaxRate(125000, 2.35)],
 }
 
 NIIT_TAX_BRACKETS = {
     "married": [TaxRate(0, 3.8)],
     "single": [TaxRate(0, 3.8)],
+    "married_separately": [TaxRate(0, 3.8)],
 }
 
 STATE_TAX_BRACKETS = {
@@ -100,4 +122,29 @@ STATE_TAX_BRACKETS = {
         TaxRate(375222, 11.3),
         TaxRate(625370, 12.3),
     ],
+    # CA uses the single schedule for married filing separately
+    "married_separately": [
+        TaxRate(0, 1),
+        TaxRate(9325, 2),
+        TaxRate(22108, 4),
+        TaxRate(34893, 6),
+        TaxRate(48436, 8),
+        TaxRate(61215, 9.3),
+        TaxRate(312687, 10.3),
+        TaxRate(375222, 11.3),
+        TaxRate(625370, 12.3),
+    ],
+}
+
+# CA mental health services tax, 1% on income over 1M for every status
+CA_MENTAL_HEALTH_TAX_BRACKETS = {
+    "married": [TaxRate(0, 0), TaxRate(1000000, 1)],
+    "single": [TaxRate(0, 0), TaxRate(1000000, 1)],
+    "married_separately": [TaxRate(0, 0), TaxRate(1000000, 1)],
+}
+
+# every bracket schedule each state levies on income, states not listed have
+# no income tax
+STATE_TAX_BRACKETS_BY_STATE = {
+    "CA": [STATE_TAX_BRACKETS, CA_MENTAL_HEALTH_TAX_BRACKETS],
 }
@@ -0,0 +1,105 @@
+import calendar
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class Grant:
+    # size is in units, or in dollars for RSU grants quoted by value
+    size: float
+    start_date: datetime
+    cliff_months: int = 12
+    cadence_months: int = 3
+    vest_months: int = 48
+
+    def __post_init__(self):
+        if not isinstance(self.start_date, datetime):
+            raise ValueError("grants need a start_date")
+        if self.cadence_months <= 0 or self.vest_months <= 0:
+            raise ValueError("cadence_months and vest_months must be positive")
+        if not 0 <= self.cliff_months <= self.vest_months:
+            raise ValueError("cliff_months must be between 0 and vest_months")
+
+    def first_vest_units(self):
+        _, fractions = vest_fractions(
+            self.cliff_months, self.cadence_months, self.vest_months
+        )
+        return self.size * fractions[0]
+
+
+@lru_cache(maxsize=None)
+def vest_fractions(cliff_months, cadence_months, vest_months):
+    # months after the start date of every vest and the fraction of the grant
+    # vesting then; shared by every grant on the same plan
+    months = np.arange(
+        max(cliff_months, cadence_months), vest_months + 1, cadence_months
+    )
+    if months[-1] != vest_months:
+        months = np.append(months, vest_months)
+    fractions = np.diff(months, prepend=0) / vest_months
+    months.flags.writeable = False
+    fractions.flags.writeable = False
+    return months, fractions
+
+
+def add_months(date: datetime, months) -> datetime:
+    month = date.month - 1 + months
+    year = date.year + month // 12
+    month = month % 12 + 1
+    day = min(date.day, calendar.monthrange(year, month)[1])
+    return date.replace(year=year, month=month, day=day)
+
+
+@lru_cache(maxsize=None)
+def vest_calendar(grant: Grant):
+    # vest dates and cumulative vested units, computed once per grant
+    months, fractions = vest_fractions(
+        grant.cliff_months, grant.cadence_months, grant.vest_months
+    )
+    dates = np.array(
+        [add_months(grant.start_date, int(month)) for month in months],
+        dtype="datetime64[D]",
+    )
+    vested = np.cumsum(fractions) * grant.size
+    dates.flags.writeable = False
+    vested.flags.writeable = False
+    return dates, vested
+
+
+def vested_to_date(grants: List[Grant], dates: List[datetime]):
+    # units of every grant vested by each date (inclusive), as an array of
+    # shape (len(grants), len(dates))
+    dates = np.array(dates, dtype="datetime64[D]")
+    matrix = np.zeros((len(grants), len(dates)))
+    for idx, grant in enumerate(grants):
+        vest_dates, vested = vest_calendar(grant)
+        counts = np.searchsorted(vest_dates, dates, side="right")
+        matrix[idx] = np.concatenate(([0], vested))[counts]
+    return matrix
+
+
+def vesting_matrix(grants: List[Grant], boundaries: List[datetime]):
+    """
+    Units of every grant vesting in each period between consecutive
+    boundaries (a vest on a boundary counts in the period it ends), as an
+    array of shape (len(grants), len(boundaries) - 1).
+    """
+    return np.diff(vested_to_date(grants, boundaries), axis=1)
+
+
+def vested_by_year(grants: List[Grant], years: List[int]):
+    # units (or dollars) of every grant vesting in each calendar year, in the
+    # order of years, which don't need to be sorted or consecutive
+    ends = vested_to_date(grants, [datetime(year, 12, 31) for year in years])
+    starts = vested_to_date(grants, [datetime(year - 1, 12, 31) for year in years])
+    return ends - starts
+
+
+def vested_income(grants: List[Grant], years: List[int], prices=1.0):
+    # vested value per year summed over grants; prices is one price per year
+    # (or a scalar), 1.0 for grants already sized in dollars
+    return (vested_by_year(grants, years) * prices).sum(axis=0)